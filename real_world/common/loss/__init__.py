@@ -1,6 +1,10 @@
+import math
+import torch
 import torch.nn as nn
 import torch.nn.functional as F
 
+LOG_2PI = math.log(2 * math.pi)
+
 
 class KnowledgeDistillationLoss(nn.Module):
     """Knowledge Distillation Loss.
@@ -29,3 +33,35 @@ class KnowledgeDistillationLoss(nn.Module):
     def forward(self, y_student, y_teacher):
         """"""
         return self.kl(F.log_softmax(y_student / self.T, dim=-1), F.softmax(y_teacher / self.T, dim=-1))
+
+
+@torch.jit.script
+def gaussian_log_prob(x: torch.Tensor, mu: torch.Tensor, logvar: torch.Tensor) -> torch.Tensor:
+    r"""Element-wise log density of a diagonal Gaussian, parameterized by its log-variance.
+
+    Equivalent to ``Normal(mu, torch.exp(logvar / 2)).log_prob(x)`` without building a
+    distribution object or recomputing ``log(std)`` from ``std``. Scripted so that the
+    pointwise chain can be fused into a single kernel.
+
+    Inputs:
+        - x (tensor): samples
+        - mu (tensor): mean of the Gaussian
+        - logvar (tensor): log-variance of the Gaussian
+
+    Shape:
+        - x, mu, logvar: (minibatch, *), output has the same shape
+    """
+    return -0.5 * (logvar + (x - mu).pow(2) * torch.exp(-logvar) + LOG_2PI)
+
+
+@torch.jit.script
+def standard_normal_log_prob(x: torch.Tensor) -> torch.Tensor:
+    r"""Element-wise log density of the standard normal :math:`\mathcal{N}(0, 1)`.
+
+    Equivalent to ``Normal(torch.zeros_like(x), torch.ones_like(x)).log_prob(x)`` without
+    allocating the zero / one parameter tensors.
+
+    Shape:
+        - x: (minibatch, *), output has the same shape
+    """
+    return -0.5 * (x.pow(2) + LOG_2PI)
@@ -171,9 +171,9 @@ class CasualOOD(nn.Module):
             nn.Linear(dim, self.z_dim)  # 潜在空间的维度是z_dim
         )
 
-        # Projection layers for decoupling the features into invariant and spurious
-        self.projection_phi = nn.Linear(self.z_dim, self.c_dim)  # Project to invariant features
-        self.projection_psi = nn.Linear(self.z_dim, self.s_dim)  # Project to spurious features
+        # Projection layer for decoupling the features into invariant and spurious:
+        # rows [0:c_dim] project to invariant features (phi), rows [c_dim:] to spurious features (psi)
+        self.projection = nn.Linear(self.z_dim, self.c_dim + self.s_dim)
 
         # Classifiers for stable (content) and unstable (style) features
         self.classifier_u = nn.Sequential(
@@ -227,6 +227,21 @@ class CasualOOD(nn.Module):
             out = self.pool_layer(out)
         return out
 
+    def project(self, z):
+        """
+        用一次矩阵乘法同时计算 phi 和 psi 投影，再拆分为不变特征和虚假特征
+        """
+        z_u, z_s = self.projection(z).split([self.c_dim, self.s_dim], dim=1)
+        return z_u, z_s
+
+    def _load_from_state_dict(self, state_dict, prefix, *args, **kwargs):
+        # 兼容旧的检查点：将分开保存的 projection_phi / projection_psi 合并为 projection
+        for name in ('weight', 'bias'):
+            phi, psi = prefix + 'projection_phi.' + name, prefix + 'projection_psi.' + name
+            if phi in state_dict and psi in state_dict:
+                state_dict[prefix + 'projection.' + name] = torch.cat([state_dict.pop(phi), state_dict.pop(psi)], 0)
+        super(CasualOOD, self)._load_from_state_dict(state_dict, prefix, *args, **kwargs)
+
     def predict_u(self, z_u):
         u_logits = self.classifier_u(z_u)
         return u_logits
@@ -264,8 +279,7 @@ class CasualOOD(nn.Module):
         z = self.encoder(x_feat)
 
         # Step 3: Apply projections to decouple into invariant and spurious features
-        z_u = self.projection_phi(z)  # Invariant features
-        z_s = self.projection_psi(z)  # Spurious features
+        z_u, z_s = self.project(z)
 
         # De-influence z_s using Gumbel-Softmax with a learnable temperature
         tilde_z_s = self.domain_influence(z_s)  # Remove the domain influence; back to Gaussian
@@ -288,8 +302,7 @@ class CasualOOD(nn.Module):
         z = self.encoder(x_feat)
 
         # Step 3: Apply projections to decouple into invariant and spurious features
-        z_u = self.projection_phi(z)  # Invariant features
-        z_s = self.projection_psi(z)  # Spurious features
+        z_u, z_s = self.project(z)
 
         return z_u, z_s
 
@@ -298,18 +311,24 @@ class CasualOOD(nn.Module):
 
         # Use itertools.chain() to combine parameters from different layers
         base_params = itertools.chain(self.encoder.parameters(),
-                                      self.projection_phi.parameters(),
-                                      self.projection_psi.parameters(),
+                                      self.projection.parameters(),
                                       self.classifier.parameters(),
                                       self.classifier_u.parameters(),
                                       self.classifier_s.parameters(),
                                       self.classifier_tilde_s.parameters())
 
-        params = [
-            {"params": self.backbone_net.parameters(), "lr": 0.1 * base_lr},  # backbone使用较小的学习率
-            {"params": base_params, "lr": 1.0 * base_lr},  # projection_phi, projection_psi, classifier使用默认学习率
-            {"params": self.temperature, "lr": 1.0 * base_lr}  # 只训练temperature
-        ]
+        params = []
+        for group_params, lr in [(self.backbone_net.parameters(), 0.1 * base_lr),  # backbone使用较小的学习率
+                                 (base_params, 1.0 * base_lr)]:  # projection, classifier使用默认学习率
+            # 权重矩阵使用权重衰减，bias 和 BatchNorm 等一维参数不使用
+            decay, no_decay = [], []
+            for p in group_params:
+                (no_decay if p.ndim <= 1 else decay).append(p)
+            params += [
+                {"params": decay, "lr": lr},
+                {"params": no_decay, "lr": lr, "weight_decay": 0.},
+            ]
+        params.append({"params": self.temperature, "lr": 1.0 * base_lr, "weight_decay": 0.})  # 只训练temperature
 
         return params
 
@@ -394,6 +413,12 @@ class iVAE(nn.Module):
         if self.flow_type in ['sf', 'dsf', 'ddsf']:
             domain_num_params = self.domain_flow.num_params * self.s_dim
             self.domain_mlp = MLP(1024, domain_num_params)
+        # the flow type is fixed at construction, so bind the matching branch once instead of
+        # comparing flow_type strings on every forward
+        if self.flow_type == 'nsf':
+            self._domain_influence = self._nsf_domain_influence
+        else:
+            self._domain_influence = self._ds_domain_influence
 
         # print(self.encoder, self.fc_mu, self.fc_logvar)
         # print(self.decoder, self.classifier, self.stable_classifier, self.unstable_classifier)
@@ -447,21 +472,23 @@ class iVAE(nn.Module):
 
 
     def domain_influence(self, z, u):
+        return self._domain_influence(z, u)
 
-        if self.flow_type == 'nsf':
-            zcont = z[:, :-self.s_dim]
-            tilde_zs = self.domain_flow(z[:, -self.s_dim:], u)
-
-        else:
-            domain_embedding = self.u_embedding(u)  # B,h_dim
-            B, _ = domain_embedding.size()
-            dsparams = self.domain_mlp(domain_embedding)  # B, ndim
-            dsparams = dsparams.view(B, self.s_dim, -1)
-            zcont = z[:,:self.c_dim]
-            tilde_zs, logdet = self.domain_flow(z[:,-self.s_dim:], dsparams)
-
+    def _nsf_domain_influence(self, z, u):
+        zcont = z[:, :-self.s_dim]
+        tilde_zs, logdet = self.domain_flow(z[:, -self.s_dim:], u)
         tilde_z = torch.cat([zcont, tilde_zs], 1)
+        return tilde_z, logdet
 
+    def _ds_domain_influence(self, z, u):
+        # flow parameters only depend on the domain index: run the MLP once per embedding row
+        # and index per sample, instead of embedding + MLP for every sample in the batch
+        domain_dsparams = self.domain_mlp(self.u_embedding.weight)  # num_domains, ndim
+        B = u.size(0)
+        dsparams = domain_dsparams[u].view(B, self.s_dim, -1)  # B, s_dim, num_params
+        zcont = z[:,:self.c_dim]
+        tilde_zs, logdet = self.domain_flow(z[:,-self.s_dim:], dsparams)
+        tilde_z = torch.cat([zcont, tilde_zs], 1)
         return tilde_z, logdet
 
     def decode(self, z):
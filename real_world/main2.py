@@ -20,17 +20,12 @@ from torch.utils.data import DataLoader
 import torch.nn.functional as F
 import wandb
 
-from extract_features import extract_features
 from pseudo_label import combined_inference
 from train import  CasualOOD_train,CasualOOD_finetune
 
 import utils
-from common.modules.networks import iVAE,Classifier,Decoupler
 from common.utils.data import ForeverDataIterator
-from common.utils.metric import accuracy
-from common.utils.meter import AverageMeter, ProgressMeter
 from common.utils.logger import CompleteLogger
-from common.utils.analysis import collect_feature, tsne, a_distance
 
 device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 # os.environ['WANDB_MODE'] = 'disabled'
@@ -91,6 +86,12 @@ def main(args: argparse.Namespace):
     backbone = utils.get_model(args.arch, pretrain=not args.scratch)
 
     model=CasualOOD(args, backbone_net=backbone).to(device)
+    if args.compile:
+        if hasattr(torch, 'compile'):
+            # 只编译 encode（训练和推理的热路径），state_dict 与 get_parameters 不受影响
+            model.encode = torch.compile(model.encode, dynamic=True)
+        else:
+            warnings.warn('torch.compile requires PyTorch >= 2.0, running in eager mode.')
     # define optimizer and lr scheduler
     optimizer = SGD(model.get_parameters(),
                     lr=args.lr, momentum=args.momentum, weight_decay=args.weight_decay, nesterov=True)
@@ -285,6 +286,11 @@ if __name__ == '__main__':
                         metavar='N', help='print frequency (default: 100)')
     parser.add_argument('-e', '--eval-freq', default=100, type=int,
                         metavar='N', help='print frequency (default: 100)')
+    parser.add_argument('--compile', action='store_true',
+                        help='compile the encoder with torch.compile (requires PyTorch >= 2.0)')
+    parser.add_argument('--precision', type=str, default='fp32', choices=['fp32', 'bf16'],
+                        help='precision of the forward pass during training and finetuning '
+                             '(bf16 uses autocast mixed precision)')
 
     # 随机种子和评估选项
     parser.add_argument('--seed', default=5, type=int,
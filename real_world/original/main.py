@@ -19,6 +19,7 @@ import wandb
 
 import utils
 from common.modules.networks import iVAE
+from common.loss import gaussian_log_prob, LOG_2PI
 from common.utils.data import ForeverDataIterator
 from common.utils.metric import accuracy
 from common.utils.meter import AverageMeter, ProgressMeter
@@ -160,7 +161,8 @@ def train(train_source_iter: ForeverDataIterator, train_target_iter: ForeverData
         [batch_time, data_time, cls_losses, ent_losses, vae_losses, recon_losses, kl_losses, cls_accs, val_accs],
         prefix="Epoch: [{}]".format(epoch)
     )
-    normal_distribution = torch.distributions.MultivariateNormal(torch.zeros(args.z_dim).cuda(), torch.eye(args.z_dim).cuda())
+    # 标准正态先验 N(0, I) 的归一化常数，无需构造单位协方差矩阵
+    log_pz_const = 0.5 * args.z_dim * LOG_2PI
 
     # switch to train mode
     model.train()
@@ -213,10 +215,8 @@ def train(train_source_iter: ForeverDataIterator, train_target_iter: ForeverData
             z, tilde_z, mu, log_var, logdet_u, logit = model.encode(x_dom, u=d_dom, track_bn=is_target)
 
             # VAE KL Loss
-            q_dist = torch.distributions.Normal(mu, torch.exp(torch.clamp(log_var, min=-10) / 2))
-            log_qz = q_dist.log_prob(z)
-            log_pz = normal_distribution.log_prob(tilde_z) + logdet_u
-            kl = (log_qz.sum(dim=1) - log_pz).mean()
+            log_qz = gaussian_log_prob(z, mu, torch.clamp(log_var, min=-10))
+            kl = (log_qz.sum(dim=1) + 0.5 * tilde_z.pow(2).sum(dim=1) + log_pz_const - logdet_u).mean()
 
              # 设置一个平滑的C值，以便在迭代过程中平滑调节
             C = torch.clamp(torch.tensor(args.C_max) / args.C_stop_iter * total_iter, 0, args.C_max)
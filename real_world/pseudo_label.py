@@ -1,5 +1,4 @@
 import torch
-from extract_features import extract_features
 import torch.nn.functional as F
 
 
@@ -20,25 +19,20 @@ def combined_inference(model, test_loader,num_classes):
             data, labels,domains = batch[:3]
             data = data.to(device)
             labels = labels.to(device)
-            domains=domains.to(device)
-            one_hot_labels = F.one_hot(labels, num_classes)
-
-            # decoupler model inference to decouple content and style
-            z_u,z_s,u_logits,s_logits,tilde_s_logits=model.encode(data)
-
 
+            # 第一遍只需要稳定分类器的输出，跳过虚假特征分支
+            z_u, _ = model.extract_feature(data)
+            u_logits = model.predict_u(z_u)
 
-            stable_pred_softmax = F.softmax(u_logits, dim=1)  # Softmax for multi-class classification
-            stable_pred_hard = torch.argmax(stable_pred_softmax, dim=1)
+            # softmax 不改变 argmax，直接在 logits 上取硬标签
+            stable_pred_hard = torch.argmax(u_logits, dim=1)
 
             # 更新先验分布
-            PY += one_hot_labels.sum(dim=0)
+            PY += torch.bincount(labels, minlength=num_classes)
 
-            # 计算混淆矩阵
-            for i in range(len(labels)):  # 对每一个样本
-                true_label = labels[i].item()  # 真实标签
-                predicted_label = stable_pred_hard[i].item()  # 预测标签
-                e_matrix[true_label, predicted_label] += 1
+            # 计算混淆矩阵（在设备上累加，避免逐样本 .item() 同步）
+            e_matrix.index_put_((labels, stable_pred_hard), torch.ones_like(labels, dtype=e_matrix.dtype),
+                                accumulate=True)
 
 
     # 归一化混淆矩阵和先验分布
@@ -50,7 +44,7 @@ def combined_inference(model, test_loader,num_classes):
     PY = PY / PY.sum()
 
     # 第二遍：使用调整后的不稳定模型预测
-    correct = 0
+    correct = torch.zeros((), device=device)
     total = 0
     OOD = 0
     with torch.no_grad():
@@ -59,7 +53,6 @@ def combined_inference(model, test_loader,num_classes):
             data, labels,domains = batch[:3]
             data = data.to(device)
             labels = labels.to(device)
-            domains=domains.to(device)
 
             # decoupler model inference to decouple content and style
             z_u,z_s,u_logits,s_logits,tilde_s_logits=model.encode(data)
@@ -67,7 +60,6 @@ def combined_inference(model, test_loader,num_classes):
             # Stable model prediction using content (z_content)
 
             stable_pred_softmax = F.softmax(u_logits, dim=1)
-            stable_pred_hard = torch.argmax(stable_pred_softmax, dim=1)
 
             # Unstable model prediction using style (z_style)
 
@@ -90,11 +82,11 @@ def combined_inference(model, test_loader,num_classes):
             # 转换为硬标签（单标签分类选择最大概率）
             predicted = torch.argmax(predict, dim=1)
 
-            correct += (predicted == labels).sum().item()
+            correct += (predicted == labels).sum()
             total += labels.size(0)
 
     # 输出准确率
-    accuracy = correct / total*100.0
+    accuracy = correct.item() / total*100.0
     return accuracy
 
 
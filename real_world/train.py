@@ -10,6 +10,7 @@ from torch.optim.lr_scheduler import LambdaLR
 from torch.utils.data import DataLoader
 from common.utils.meter import AverageMeter, ProgressMeter
 from common.utils.metric import accuracy
+from common.loss import standard_normal_log_prob
 import wandb
 from common.utils import ForeverDataIterator
 
@@ -17,6 +18,34 @@ from common.utils import ForeverDataIterator
 device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 
 
+def encode(model, img, args: argparse.Namespace):
+    """
+    调用 model.encode；当 args.precision == 'bf16' 时在 bf16 autocast 下前向，
+    输出统一转回 fp32，保证后续的损失和 KL 在 fp32 下计算
+    """
+    with torch.autocast(device_type=device.type, dtype=torch.bfloat16, enabled=args.precision == 'bf16'):
+        outputs = model.encode(img)
+    return tuple(t.float() for t in outputs)
+
+
+def copy_stats_async(stats, host_buffer):
+    """
+    将一组标量统计量合并为一个张量，以一次非阻塞拷贝送到（锁页）主机缓冲区，
+    避免每个统计量单独 .item() 造成的多次阻塞同步；返回用于等待拷贝完成的 event
+    """
+    host_buffer.copy_(torch.stack(stats).detach(), non_blocking=True)
+    if not host_buffer.is_pinned():
+        return None
+    event = torch.cuda.Event()
+    event.record()
+    return event
+
+
+def wait_stats(event, host_buffer):
+    """等待 copy_stats_async 的拷贝完成，并以 Python 浮点数列表返回统计量"""
+    if event is not None:
+        event.synchronize()
+    return host_buffer.tolist()
 
 
 def CasualOOD_train(train_source_iter: ForeverDataIterator, val_iter: ForeverDataIterator,
@@ -39,6 +68,8 @@ def CasualOOD_train(train_source_iter: ForeverDataIterator, val_iter: ForeverDat
         [batch_time, data_time, cls_losses, total_losses,cls_accs,stable_cls_losses,unstable_cls_losses, KL_losses,MI_losses, val_accs],
         prefix="Epoch: [{}]".format(epoch)
     )
+    stat_meters = [cls_losses, stable_cls_losses, unstable_cls_losses, cls_accs, total_losses, KL_losses, MI_losses]
+    stats_host = torch.empty(len(stat_meters), pin_memory=device.type == 'cuda')
 
     # switch to train mode
     model.train()
@@ -81,7 +112,7 @@ def CasualOOD_train(train_source_iter: ForeverDataIterator, val_iter: ForeverDat
 
             # 特征提取
 
-            z_u,z_s,u_logits,s_logits,tilde_s_logits=model.encode(img_dom)
+            z_u,z_s,u_logits,s_logits,tilde_s_logits=encode(model, img_dom, args)
 
             logits=u_logits+tilde_s_logits
 
@@ -100,8 +131,7 @@ def CasualOOD_train(train_source_iter: ForeverDataIterator, val_iter: ForeverDat
 
             # 计算可变特征的KL散度损失
             # 目标是让不稳定预测标签（基于z_s）接近标准正态分布
-            q_dist = torch.distributions.Normal(torch.zeros_like(s_logits), torch.ones_like(s_logits))
-            log_qz = q_dist.log_prob(s_logits)
+            log_qz = standard_normal_log_prob(s_logits)
             loss_kl = -log_qz.mean()
 
             # 解藕总损失 = 解藕正则化损失 + KL损失
@@ -131,14 +161,9 @@ def CasualOOD_train(train_source_iter: ForeverDataIterator, val_iter: ForeverDat
         labels_s = torch.cat(labels_s, 0)
         cls_acc = accuracy(y_s, labels_s)[0]
 
-        # 更新统计数据
-        cls_losses.update(mean_cls_losses.item(), y_s.size(0))  # 更新分类损失
-        stable_cls_losses.update(mean_cls_u.item(), y_s.size(0))
-        unstable_cls_losses.update(mean_cls_s.item(), y_s.size(0))
-        cls_accs.update(cls_acc.item(), y_s.size(0))  # 更新分类准确率
-        total_losses.update(loss.item(), y_s.size(0))  # 更新总损失
-        KL_losses.update(mean_kl_losses.item(), y_s.size(0))
-        MI_losses.update(mean_MI_losses.item(), y_s.size(0))
+        # 统计数据异步拷贝到主机，与反向传播重叠
+        stats_event = copy_stats_async([mean_cls_losses, mean_cls_u, mean_cls_s, cls_acc, loss,
+                                        mean_kl_losses, mean_MI_losses], stats_host)
 
         # compute gradient and do SGD step
         optimizer.zero_grad()
@@ -146,6 +171,11 @@ def CasualOOD_train(train_source_iter: ForeverDataIterator, val_iter: ForeverDat
         optimizer.step()
         lr_scheduler.step()  # 更新学习率
 
+        # 更新统计数据（分类损失、分类准确率、总损失等）
+        stats = wait_stats(stats_event, stats_host)
+        for meter, value in zip(stat_meters, stats):
+            meter.update(value, y_s.size(0))
+
         # measure elapsed time
         batch_time.update(time.time() - end)
         end = time.time()
@@ -155,24 +185,23 @@ def CasualOOD_train(train_source_iter: ForeverDataIterator, val_iter: ForeverDat
             # 将图像和标签数据移至GPU
             img_val = img_val.to(device)
             labels_val = labels_val.to(device)
-            d_val = d_val.to(device)
 
             with torch.no_grad():
                 y = model(img_val)
-                cls_t_acc = accuracy(y, labels_val)[0]
-                val_accs.update(cls_t_acc.item(), img_val.size(0))
+                cls_t_acc = accuracy(y, labels_val)[0].item()
+                val_accs.update(cls_t_acc, img_val.size(0))
             model.train()
 
             progress.display(i)
 
             # 记录训练过程的指标
             wandb.log({
-                "Train Val Acc": cls_t_acc.item(),
-                "Train Acc": cls_acc.item(),
-                "Train Loss": loss.item(),
-                "Train Cls Loss": mean_cls_losses.item(),
-                "Train KL": mean_kl_losses.item(),
-                "Train MI Loss": mean_MI_losses.item(),
+                "Train Val Acc": cls_t_acc,
+                "Train Acc": cls_accs.val,
+                "Train Loss": total_losses.val,
+                "Train Cls Loss": cls_losses.val,
+                "Train KL": KL_losses.val,
+                "Train MI Loss": MI_losses.val,
 
             })
 
@@ -195,6 +224,8 @@ def CasualOOD_finetune(train_target_iter: ForeverDataIterator, val_iter: Forever
         [batch_time, data_time, cls_losses, total_losses, cls_accs, stable_cls_losses, unstable_cls_losses, val_accs],
         prefix="Epoch: [{}]".format(epoch)
     )
+    stat_meters = [cls_losses, unstable_cls_losses, cls_accs, total_losses]
+    stats_host = torch.empty(len(stat_meters), pin_memory=device.type == 'cuda')
 
     # Switch to train mode
     model.train()
@@ -229,11 +260,10 @@ def CasualOOD_finetune(train_target_iter: ForeverDataIterator, val_iter: Forever
         index = d_train == args.n_domains - 1  # 目标域样本
 
         # 特征提取
-        z_u, z_s, u_logits, s_logits, tilde_s_logits = model.encode(img_train)
+        z_u, z_s, u_logits, s_logits, tilde_s_logits = encode(model, img_train, args)
 
         # 生成伪标签
-        pseudo_labels = torch.argmax(u_logits, dim=1)
-        pseudo_labels = pseudo_labels.to(device)  # 使用伪标签
+        pseudo_labels = torch.argmax(u_logits, dim=1)  # 使用伪标签，已在同一设备上
 
         loss_cls_s = F.cross_entropy(tilde_s_logits, pseudo_labels)
 
@@ -265,11 +295,8 @@ def CasualOOD_finetune(train_target_iter: ForeverDataIterator, val_iter: Forever
         labels_s = torch.cat(labels_s, 0)
         cls_acc = accuracy(y_s, labels_s)[0]
 
-        # 更新统计数据
-        cls_losses.update(mean_cls_losses.item(), y_s.size(0))  # 更新分类损失
-        unstable_cls_losses.update(mean_cls_s.item(), y_s.size(0))
-        cls_accs.update(cls_acc.item(), y_s.size(0))  # 更新分类准确率
-        total_losses.update(loss.item(), y_s.size(0))  # 更新总损失
+        # 统计数据异步拷贝到主机，与反向传播重叠
+        stats_event = copy_stats_async([mean_cls_losses, mean_cls_s, cls_acc, loss], stats_host)
 
         # 计算梯度并执行 SGD 步骤
         optimizer.zero_grad()
@@ -277,6 +304,11 @@ def CasualOOD_finetune(train_target_iter: ForeverDataIterator, val_iter: Forever
         optimizer.step()
         lr_scheduler.step()  # 更新学习率
 
+        # 更新统计数据（分类损失、分类准确率、总损失）
+        stats = wait_stats(stats_event, stats_host)
+        for meter, value in zip(stat_meters, stats):
+            meter.update(value, y_s.size(0))
+
         # 测量经过的时间
         batch_time.update(time.time() - end)
         end = time.time()
@@ -286,19 +318,18 @@ def CasualOOD_finetune(train_target_iter: ForeverDataIterator, val_iter: Forever
             # 将图像和标签数据移至GPU
             img_val = img_val.to(device)
             labels_val = labels_val.to(device)
-            d_val = d_val.to(device)
 
             with torch.no_grad():
                 y = model(img_val)
-                cls_t_acc = accuracy(y, labels_val)[0]
-                val_accs.update(cls_t_acc.item(), img_val.size(0))
+                cls_t_acc = accuracy(y, labels_val)[0].item()
+                val_accs.update(cls_t_acc, img_val.size(0))
             model.train()
 
             progress.display(i)
 
             # 记录训练过程的指标
             wandb.log({
-                "Finetune Val Acc": cls_t_acc.item(),
-                "Finetune Acc": cls_acc.item(),
-                "Finetune Loss": loss.item()
+                "Finetune Val Acc": cls_t_acc,
+                "Finetune Acc": cls_accs.val,
+                "Finetune Loss": total_losses.val
             })
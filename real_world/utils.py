@@ -17,9 +17,9 @@ import common.vision.datasets as datasets
 import common.vision.models as models
 from common.vision.transforms import ResizeImage
 from common.utils.metric import accuracy, ConfusionMatrix
+from common.loss import gaussian_log_prob, LOG_2PI
 from common.utils.meter import AverageMeter, ProgressMeter
 from torchvision.utils import save_image
-from extract_features import extract_features
 
 def get_model_names():
     return sorted(
@@ -250,7 +250,6 @@ def validate_classifier(decoupler_model, stable_classifier, unstable_classifier,
 
             # 生成伪标签
             pseudo_labels = torch.argmax(stable_output, dim=1)
-            pseudo_labels = pseudo_labels.to(device)
 
             # 使用不稳定分类器进行预测
             unstable_output = unstable_classifier(style)
@@ -260,11 +259,11 @@ def validate_classifier(decoupler_model, stable_classifier, unstable_classifier,
             stable_acc, = accuracy(stable_output, target, topk=(1,))
             unstable_acc, = accuracy(unstable_output, pseudo_labels, topk=(1,))
 
-            # 更新统计
-            stable_losses.update(stable_loss.item(), images.size(0))
-            unstable_losses.update(unstable_loss.item(), images.size(0))
-            top1_stable.update(stable_acc.item(), images.size(0))
-            top1_unstable.update(unstable_acc.item(), images.size(0))
+            # 更新统计（保留为设备上的张量，只在打印和返回时同步）
+            stable_losses.update(stable_loss, images.size(0))
+            unstable_losses.update(unstable_loss, images.size(0))
+            top1_stable.update(stable_acc, images.size(0))
+            top1_unstable.update(unstable_acc, images.size(0))
 
             # 计时
             batch_time.update(time.time() - end)
@@ -273,7 +272,7 @@ def validate_classifier(decoupler_model, stable_classifier, unstable_classifier,
             # if i % args.print_freq == 0:
             #     progress.display(i)
     progress.display(i)
-    return top1_stable.avg, top1_unstable.avg
+    return float(top1_stable.avg), float(top1_unstable.avg)
 
 
 def validate_vae(val_loader, model, args, total_iter,device) -> float:
@@ -290,8 +289,10 @@ def validate_vae(val_loader, model, args, total_iter,device) -> float:
         [batch_time,losses_vae, losses_cls, losses_kl, losses_recon, total_loss, top1],
         prefix='Test: ')
 
-    normal_distribution = torch.distributions.MultivariateNormal(torch.zeros(args.z_dim).cuda(),
-                                                                 torch.eye(args.z_dim).cuda())
+    # normalizing constant of the standard normal prior N(0, I), shared by every batch
+    log_pz_const = 0.5 * args.z_dim * LOG_2PI
+    # Smooth C value to adjust KL loss; total_iter is fixed during validation
+    C = torch.clamp(torch.tensor(args.C_max) / args.C_stop_iter * total_iter, 0, args.C_max)
 
     # switch to evaluate mode
     model.eval()
@@ -317,14 +318,10 @@ def validate_vae(val_loader, model, args, total_iter,device) -> float:
             # Classification loss
             cls_loss = F.cross_entropy(logit, target)
 
-            # VAE KL loss
-            q_dist = torch.distributions.Normal(mu, torch.exp(torch.clamp(log_var, min=-10) / 2))
-            log_qz = q_dist.log_prob(z)
-            log_pz = normal_distribution.log_prob(tilde_z) + logdet_u
-            kl = (log_qz.sum(dim=1) - log_pz).mean()
+            # VAE KL loss: log q(z|x) - log p(tilde_z) - logdet_u, with the N(0, I) prior in closed form
+            kl = (gaussian_log_prob(z, mu, torch.clamp(log_var, min=-10)).sum(dim=1)
+                  + 0.5 * tilde_z.pow(2).sum(dim=1) + log_pz_const - logdet_u).mean()
 
-            # Smooth C value to adjust KL loss during training
-            C = torch.clamp(torch.tensor(args.C_max) / args.C_stop_iter * total_iter, 0, args.C_max)
             loss_kl = args.beta * (kl - C).abs()  # KL loss
 
             # Reconstruction loss
@@ -339,16 +336,16 @@ def validate_vae(val_loader, model, args, total_iter,device) -> float:
             # Total loss (Classification loss + VAE loss)
             total_val_loss = cls_loss + args.lambda_vae * mean_loss_vae
 
-            # Update meters
-            losses_vae.update(mean_loss_vae.item(), images.size(0))
-            losses_cls.update(cls_loss.item(), images.size(0))
-            losses_kl.update(loss_kl.item(), images.size(0))
-            losses_recon.update(recon_loss.item(), images.size(0))
-            total_loss.update(total_val_loss.item(), images.size(0))
+            # Update meters (kept as device tensors, synced only on display and return)
+            losses_vae.update(mean_loss_vae, images.size(0))
+            losses_cls.update(cls_loss, images.size(0))
+            losses_kl.update(loss_kl, images.size(0))
+            losses_recon.update(recon_loss, images.size(0))
+            total_loss.update(total_val_loss, images.size(0))
 
             # Measure accuracy
             acc1 = accuracy(logit, target)[0]
-            top1.update(acc1.item(), images.size(0))
+            top1.update(acc1, images.size(0))
 
             # Confusion matrix update
             if confmat:
@@ -366,7 +363,7 @@ def validate_vae(val_loader, model, args, total_iter,device) -> float:
 
 
     progress.display(i)
-    return top1.avg, total_loss.avg
+    return float(top1.avg), float(total_loss.avg)
 
 
 def get_train_transform(resizing='default', random_horizontal_flip=True, random_color_jitter=False,
@@ -479,12 +476,12 @@ def validate_decoupler(val_loader, model, args, device) -> float:
             output = model(images)
             loss = F.cross_entropy(output, target)
 
-            # measure accuracy and record loss
+            # measure accuracy and record loss (kept as device tensors, synced only on display and return)
             acc1, = accuracy(output, target, topk=(1,))
             if confmat:
                 confmat.update(target, output.argmax(1))
-            losses.update(loss.item(), images.size(0))
-            top1.update(acc1.item(), images.size(0))
+            losses.update(loss, images.size(0))
+            top1.update(acc1, images.size(0))
 
             # measure elapsed time
             batch_time.update(time.time() - end)
@@ -496,7 +493,7 @@ def validate_decoupler(val_loader, model, args, device) -> float:
         if confmat:
             print(confmat.format(args.class_names))
 
-    return top1.avg
+    return float(top1.avg)
 
 
 # def combined_inference(stable_model, unstable_model, test_loader,num_classes):